@@ -2,11 +2,26 @@
 # pi_timer_lcd.py
 # Two-player turn timer with LCD readout, LEDs, and buzzer.
 # Self-contained: custom I2C LCD driver (no RPLCD).
-# Requires: gpiozero, smbus (or smbus2)
-
-from gpiozero import Button, PWMOutputDevice, LED
-from time import monotonic, sleep
-import smbus
+# Requires: gpiozero, optionally lgpio (I2C goes straight through /dev/i2c-N)
+# Runs on CPython 3 or PyPy3: the script is pure Python (lgpio is compiled; see README).
+
+import os
+from gpiozero import Device, Button, PWMOutputDevice, LEDBoard
+from gpiozero.exc import BadPinFactory
+from time import monotonic_ns, sleep
+from enum import IntEnum
+import threading, queue, ctypes, ctypes.util, fcntl, re
+from collections import deque
+
+# Prefer lgpio (kernel GPIO character device: the button is interrupt-driven
+# instead of spin-polled). Without it gpiozero keeps its own default order;
+# GPIOZERO_PIN_FACTORY=... still overrides both.
+if "GPIOZERO_PIN_FACTORY" not in os.environ:
+    try:
+        from gpiozero.pins.lgpio import LGPIOFactory
+        Device.pin_factory = LGPIOFactory()
+    except (ImportError, BadPinFactory):
+        pass
 
 # --- CONFIG ---
 TURN_SECONDS = 10
@@ -23,28 +38,48 @@ LED_R_PIN = 25
 # I2C LCD
 I2C_ADDRESS = 0x27   # use 0x3F for some backpacks
 I2C_BUS = 1          # 0 for very old Pi, otherwise 1
+# Bus clock the LCD code is tuned for. The Pi defaults to 100 kHz; the
+# PCF8574 backpack is fine at 400 kHz. Set it in /boot/firmware/config.txt:
+#   dtparam=i2c_arm=on,i2c_arm_baudrate=400000
+# and reboot.
+I2C_BAUDRATE = 400000
+
+# Real-time scheduling (needs root; silently skipped otherwise)
+RT_PRIORITY = 50     # SCHED_FIFO priority, 1..99
+RT_CPU = 3           # pin to this core if present; boot with isolcpus=3 to reserve it
 
 # =================================================================
 # == START: I2C LCD DRIVER CODE
 # =================================================================
 
 class i2c_device:
-    """Helper class for I2C communication."""
+    """Helper class for I2C communication (raw /dev/i2c-N, no smbus needed)."""
+    I2C_SLAVE = 0x0703   # ioctl: set target address for plain read()/write()
+
     def __init__(self, addr, port=1):
         self.addr = addr
         self.port = port               # <-- remember port so we can reopen bus
-        self.bus = smbus.SMBus(port)
+        self.fd = self._open()
+    def _open(self):
+        fd = os.open(f"/dev/i2c-{self.port}", os.O_RDWR)
+        fcntl.ioctl(fd, self.I2C_SLAVE, self.addr)
+        return fd
     def reopen(self):
+        """Recover after an I/O error. Keeps the fd; only reopens if it went bad."""
+        sleep(0.001)   # let a glitched bus settle
         try:
-            # Some smbus impls don't have .close(); ignore if missing
-            if hasattr(self.bus, "close"):
-                self.bus.close()
-        except Exception:
+            fcntl.ioctl(self.fd, self.I2C_SLAVE, self.addr)
+            return
+        except OSError:
             pass
-        self.bus = smbus.SMBus(self.port)
-    def write_cmd(self, cmd):
-        self.bus.write_byte(self.addr, cmd)
-        sleep(0.0001)
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+        self.fd = self._open()
+    def write_block(self, data):
+        """Send all bytes in one I2C transaction (single START/address/STOP)."""
+        os.write(self.fd, data)
 
 class lcd:
     """16x2 I2C LCD (HD44780 over PCF8574)."""
@@ -78,55 +113,105 @@ class lcd:
     Rw = 0b00000010  # Read/Write (unused)
     Rs = 0b00000001  # Register select
 
+    # Configuration sent after the 4-bit reset (all command mode, RS=0)
+    _INIT_CMDS = (
+        LCD_FUNCTIONSET | LCD_2LINE | LCD_5x8DOTS | LCD_4BITMODE,
+        LCD_DISPLAYCONTROL | LCD_DISPLAYON | LCD_CURSOROFF | LCD_BLINKOFF,
+        LCD_ENTRYMODESET | LCD_ENTRYLEFT,   # increment, no display shift
+    )
+
     def __init__(self, addr, port):
         self.lcd_device = i2c_device(addr, port)
+        self._shadow = [b"", b""]   # bytes lines 1/2 currently show (b"" = unknown)
+        # Data-mode byte sequence for every character code, built once
+        self._char_table = [self._build_bytes(c, self.Rs) for c in range(256)]
+        # Reused burst buffer for one full line (16 chars x 6 bytes)
+        self._burst = bytearray(6 * 16)
+        self._burst_view = memoryview(self._burst)
         self.init_hw()
 
     # --- init/reset helpers ---
     def init_hw(self):
         """Send the standard 4-bit init sequence + basic config."""
-        self.lcd_write(0x03); self.lcd_write(0x03); self.lcd_write(0x03); self.lcd_write(0x02)
-        self.lcd_write(self.LCD_FUNCTIONSET | self.LCD_2LINE | self.LCD_5x8DOTS | self.LCD_4BITMODE)
-        self.lcd_write(self.LCD_DISPLAYCONTROL | self.LCD_DISPLAYON | self.LCD_CURSOROFF | self.LCD_BLINKOFF)
-        self.lcd_write(self.LCD_ENTRYMODESET | self.LCD_ENTRYLEFT)  # increment, no display shift
+        # Reset-to-4-bit phase: the HD44780 needs >4.1 ms after these
+        for cmd in (0x03, 0x03, 0x03, 0x02):
+            self.lcd_write(cmd)
+            sleep(0.005)
+        # Fast commands: one bulk write for the whole config
+        self.lcd_device.write_block(b"".join(self._build_bytes(cmd) for cmd in self._INIT_CMDS))
         self.lcd_clear()
         sleep(0.2)
 
     def soft_reset(self):
         """Reopen I²C bus and re-init the LCD (used after I/O errors)."""
         self.lcd_device.reopen()
+        self._shadow = [b"", b""]
         self.init_hw()
 
     # --- low-level write primitives ---
-    def lcd_strobe(self, data):
-        self.lcd_device.write_cmd(data | self.En | self.LCD_BACKLIGHT)
-        sleep(0.0005)
-        self.lcd_device.write_cmd((data & ~self.En) | self.LCD_BACKLIGHT)
-        sleep(0.0001)
+    def _build_bytes(self, cmd, mode=0):
+        """All six PCF8574 states needed to send one byte.
 
-    def lcd_write_four_bits(self, data):
-        self.lcd_device.write_cmd(data | self.LCD_BACKLIGHT)
-        self.lcd_strobe(data)
+        Per nibble: latch data, raise En, drop En (the falling edge latches).
+        """
+        bl, en = self.LCD_BACKLIGHT, self.En
+        hi = mode | (cmd & 0xF0) | bl
+        lo = mode | ((cmd << 4) & 0xF0) | bl
+        return bytes((hi, hi | en, hi, lo, lo | en, lo))
 
     def lcd_write(self, cmd, mode=0):
-        self.lcd_write_four_bits(mode | (cmd & 0xF0))
-        self.lcd_write_four_bits(mode | ((cmd << 4) & 0xF0))
+        # Both nibbles go out as one 6-byte I2C write. No sleeps needed: E
+        # falling edges are 3 I2C bytes apart (~67 us @400 kHz), which covers
+        # the 37 us HD44780 command time. Assumes a bus clock of <= 400 kHz;
+        # at 1 MHz that gap shrinks to ~27 us and is too short.
+        self.lcd_device.write_block(self._build_bytes(cmd, mode))
 
     # --- user-facing ops ---
     def lcd_clear(self):
+        # Clear/home are the only slow HD44780 commands (~1.52 ms each)
         self.lcd_write(self.LCD_CLEARDISPLAY)
+        sleep(0.002)
         self.lcd_write(self.LCD_RETURNHOME)
         sleep(0.002)
+        self._shadow = [b" " * 16, b" " * 16]
 
     def lcd_display_string(self, string, line):
-        """Write string at column 0 of line 1 or 2."""
-        if line == 1:
-            self.lcd_write(self.LCD_SETDDRAMADDR | 0x00)  # line 1 start
-        elif line == 2:
-            self.lcd_write(self.LCD_SETDDRAMADDR | 0x40)  # line 2 start
-        string = string.ljust(16)[:16]
-        for ch in string:
-            self.lcd_write(ord(ch), self.Rs)
+        """Write string at column 0 of line 1 or 2 (only cells that changed)."""
+        text = string.ljust(16)[:16].encode("ascii", "replace")   # iterates as ints
+        old = self._shadow[line - 1]
+        if text == old:
+            return
+        if old:
+            start = next(i for i in range(16) if text[i] != old[i])
+            end = next(i for i in range(15, -1, -1) if text[i] != old[i]) + 1
+        else:
+            start, end = 0, 16   # contents unknown: redraw the whole line
+        base = 0x00 if line == 1 else 0x40   # line 1 / line 2 DDRAM start
+        self.lcd_write(self.LCD_SETDDRAMADDR | (base + start))
+        # DDRAM auto-increments, so the changed span goes out as one burst
+        table, buf, pos = self._char_table, self._burst, 0
+        for b in text[start:end]:
+            buf[pos:pos + 6] = table[b]
+            pos += 6
+        self.lcd_device.write_block(self._burst_view[:pos])
+        self._shadow[line - 1] = text
+
+def i2c_bus_speed(port=1):
+    """Return the I2C clock in Hz (device tree, else config.txt), or None."""
+    path = f"/sys/class/i2c-adapter/i2c-{port}/of_node/clock-frequency"
+    try:
+        with open(path, "rb") as f:
+            return int.from_bytes(f.read(4), "big")
+    except OSError:
+        pass
+    for path in ("/boot/firmware/config.txt", "/boot/config.txt"):
+        try:
+            with open(path) as f:
+                m = re.search(r"^dtparam=.*i2c(?:_arm|1)?_baudrate=(\d+)", f.read(), re.M)
+        except OSError:
+            continue
+        return int(m.group(1)) if m else 100000   # Pi default
+    return None
 
 # =================================================================
 # == END: I2C LCD DRIVER CODE
@@ -136,15 +221,46 @@ class lcd:
 
 btn = Button(BUTTON_PIN, pull_up=True, bounce_time=0.05)
 buzzer = PWMOutputDevice(BUZZER_PIN, frequency=1000)
-LED_G = LED(LED_G_PIN)
-LED_Y = LED(LED_Y_PIN)
-LED_R = LED(LED_R_PIN)
+leds = LEDBoard(green=LED_G_PIN, yellow=LED_Y_PIN, red=LED_R_PIN)
 
 lcd = lcd(addr=I2C_ADDRESS, port=I2C_BUS)
 
-state = "IDLE"
-active_player = 1
-deadline = None
+class State(IntEnum):
+    IDLE = 0
+    P1 = 1        # player 1's turn running
+    P2 = 2        # player 2's turn running
+    TIMEOUT = 3
+
+RUNNING = frozenset((State.P1, State.P2))
+
+class Game:
+    __slots__ = ("state", "active_player", "deadline_ns")
+
+    def __init__(self):
+        self.state = State.IDLE
+        self.active_player = 1
+        self.deadline_ns = 0   # monotonic_ns() at which the current turn ends
+
+game = Game()
+wake = threading.Event()   # set on button presses/new tones to cut the main-loop sleep short
+_last_shown = (None, None)   # (player, remaining) currently on the LCD/LEDs
+_last_zone = None            # index into _LED_STATES currently lit
+
+def realtime_setup():
+    """Run under SCHED_FIFO with memory locked to keep tick/beep timing tight.
+
+    Call before starting threads: later threads inherit the policy and CPU.
+    """
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(RT_PRIORITY))
+    except (AttributeError, PermissionError):
+        print("Note: run as root for real-time scheduling (optional).")
+        return
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    MCL_CURRENT, MCL_FUTURE = 1, 2
+    libc.mlockall(MCL_CURRENT | MCL_FUTURE)
+    if RT_CPU in os.sched_getaffinity(0):
+        os.sched_setaffinity(0, {RT_CPU})
 
 # ---- LCD safe helpers (retry once on I2C error) ----
 def lcd_safe_clear():
@@ -154,111 +270,194 @@ def lcd_safe_clear():
         lcd.soft_reset()
         lcd.lcd_clear()
 
-def lcd_safe_show(player, remaining):
+def lcd_safe_frame(top, bottom):
+    # Unchanged cells cost nothing (shadow diff), and after a reset the
+    # shadow is empty so both lines get fully redrawn.
     for attempt in range(2):  # try once, then reset+retry
         try:
-            lcd.lcd_display_string(f"Player {player}", 1)
-            lcd.lcd_display_string(f"Time: {remaining:>3}s", 2)
+            lcd.lcd_display_string(top, 1)
+            lcd.lcd_display_string(bottom, 2)
             return
         except OSError:
             lcd.soft_reset()
 
-def lights_for(remaining):
-    if remaining > WARN_YELLOW:
-        LED_G.on(); LED_Y.off(); LED_R.off()
-    elif remaining > WARN_RED:
-        LED_G.off(); LED_Y.on(); LED_R.off()
-    else:
-        LED_G.off(); LED_Y.off(); LED_R.on()
-
-def beep(freq=1000, duration=0.2, vol=0.5):
-    buzzer.frequency = freq
-    buzzer.value = vol
-    sleep(duration)
-    buzzer.value = 0
+# ---- LCD worker thread ----
+# All LCD I/O happens on one thread so the timer loop never waits on I2C.
+# The queue holds at most one frame: a newer frame replaces one not yet drawn.
+lcd_queue = queue.Queue(maxsize=1)
 
-def lcd_idle(msg_top="Press to start", msg_bot="   Game Timer"):
-    lcd_safe_clear()
-    lcd_safe_show(msg_top if isinstance(msg_top, int) else msg_top, 0)  # reuse helper for line formatting
-    # Overwrite line 2 explicitly:
-    for attempt in range(2):
+def _lcd_put(item):
+    while True:
         try:
-            lcd.lcd_display_string(msg_bot, 2)
-            break
+            lcd_queue.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                lcd_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+def lcd_post(top, bottom):
+    """Queue a full two-line frame for the LCD worker; returns immediately.
+
+    Lines are padded to 16 columns, so a frame replaces everything on screen
+    and no (slow) clear is needed between screens.
+    """
+    _lcd_put((top, bottom))
+
+def _lcd_worker():
+    while True:
+        frame = lcd_queue.get()
+        if frame is None:
+            return
+        try:
+            lcd_safe_frame(*frame)
         except OSError:
-            lcd.soft_reset()
+            pass   # bus still down; the next frame tries again
+
+lcd_thread = threading.Thread(target=_lcd_worker, daemon=True)
+
+def lcd_show(player, remaining):
+    lcd_post(f"Player {player}", f"Time: {remaining:>3}s")
+
+_LED_STATES = ((1, 0, 0), (0, 1, 0), (0, 0, 1))   # green / yellow / red zone
+
+def lights_for(remaining):
+    """Set the LEDs for the current zone; writes only when the zone changes."""
+    global _last_zone
+    zone = 0 if remaining > WARN_YELLOW else 1 if remaining > WARN_RED else 2
+    if zone != _last_zone:
+        leds.value = _LED_STATES[zone]
+        _last_zone = zone
+
+# ---- Buzzer (non-blocking) ----
+# A tone pattern is a list of (freq, seconds, vol) steps; vol 0 is a silent gap.
+# play_pattern() queues it and service_buzzer(), called from the main loop,
+# flips the PWM at each step boundary, so nothing ever sleeps on a beep.
+_buzz_steps = deque()
+_buzz_until_ns = None     # end of the current step; None when silent
+_buzz_lock = threading.Lock()
+
+def beeps(freq, count, on=0.08, gap=0.07, vol=0.5):
+    pattern = []
+    for _ in range(count):
+        pattern += [(freq, on, vol), (0, gap, 0)]
+    return pattern
+
+TIMEOUT_TONES = [step for f in (1200, 1000, 800, 600, 400)
+                 for step in ((f, 0.1, 0.7), (0, 0.03, 0))]
+
+def play_pattern(steps):
+    """Replace whatever is playing with steps; returns immediately."""
+    global _buzz_until_ns
+    with _buzz_lock:
+        _buzz_steps.clear()
+        _buzz_steps.extend(steps)
+        _buzz_until_ns = 0   # first step is due now
+    wake.set()
+
+def service_buzzer():
+    """Advance the pattern; return ns until the next step is due, or None."""
+    global _buzz_until_ns
+    with _buzz_lock:
+        if _buzz_until_ns is None:
+            return None
+        now = monotonic_ns()
+        if now < _buzz_until_ns:
+            return _buzz_until_ns - now
+        if not _buzz_steps:
+            buzzer.value = 0
+            _buzz_until_ns = None
+            return None
+        freq, secs, vol = _buzz_steps.popleft()
+        if vol:
+            buzzer.frequency = freq
+        buzzer.value = vol
+        _buzz_until_ns = now + int(secs * 1_000_000_000)
+        return _buzz_until_ns - now
+
+def lcd_idle(msg_top="Press to start", msg_bot="   Game Timer"):
+    lcd_post(msg_top, msg_bot)
 
 def start_turn(player):
     """Start new turn (also does LCD cleanup each turn)."""
-    global state, active_player, deadline
-    active_player = player
-    deadline = monotonic() + TURN_SECONDS
-    state = "P1_RUNNING" if player == 1 else "P2_RUNNING"
-
-    # Stop any timeout blinking and wipe old text (CLEANUP EACH TURN)
-    LED_R.off()
-    lcd_safe_clear()
+    global _last_shown, _last_zone
+    game.active_player = player
+    game.deadline_ns = monotonic_ns() + TURN_SECONDS * 1_000_000_000
+    game.state = State.P1 if player == 1 else State.P2
+    wake.set()
+
+    # Stop any timeout blinking and replace the old text (CLEANUP EACH TURN)
+    leds.red.off()
+    _last_zone = None
+    lcd_post(f"Player {player}", f"Time: {TURN_SECONDS:>3}s")
+    _last_shown = (None, None)
 
     # Start tones: P1=2 beeps @1200Hz, P2=3 beeps @900Hz
-    count = 2 if player == 1 else 3
-    freq  = 1200 if player == 1 else 900
-    for _ in range(count):
-        beep(freq, 0.08)
-        sleep(0.07)
+    play_pattern(beeps(1200, 2) if player == 1 else beeps(900, 3))
 
 def next_player():
-    start_turn(2 if active_player == 1 else 1)
+    start_turn(2 if game.active_player == 1 else 1)
 
 def on_press():
-    global state
-    if state in ("IDLE", "TIMEOUT"):
-        next_p = 1 if state == "IDLE" else (2 if active_player == 1 else 1)
+    if game.state not in RUNNING:
+        next_p = 1 if game.state == State.IDLE else (2 if game.active_player == 1 else 1)
         start_turn(next_p)
     else:
         next_player()
 
 # --- MAIN LOOP ---
 if __name__ == "__main__":
+    realtime_setup()
+    lcd_thread.start()
     btn.when_pressed = on_press
     try:
         lcd_idle()
+        hz = i2c_bus_speed(I2C_BUS)
+        if hz is not None and hz < I2C_BAUDRATE:
+            print(f"Note: I2C bus runs at {hz // 1000} kHz; set "
+                  f"dtparam=i2c_arm_baudrate={I2C_BAUDRATE} for faster LCD updates.")
         print("LCD Game Timer Ready. Press button to start.")
         while True:
-            if state in ("P1_RUNNING", "P2_RUNNING"):
-                remaining = max(0, int(round(deadline - monotonic())))
-                lights_for(remaining)
-                lcd_safe_show(active_player, remaining)
+            buzz_ns = service_buzzer()
+            if game.state in RUNNING:
+                # Whole seconds left, rounded up; integer math only
+                remaining = max(0, (game.deadline_ns - monotonic_ns() + 999_999_999) // 1_000_000_000)
+                if (game.active_player, remaining) != _last_shown:
+                    lights_for(remaining)
+                    lcd_show(game.active_player, remaining)
+                    _last_shown = (game.active_player, remaining)
 
                 if remaining <= 0:
-                    state = "TIMEOUT"
-                    # Timeout tones
-                    for f in (1200, 1000, 800, 600, 400):
-                        beep(f, 0.1, 0.7)
-                        sleep(0.03)
-                    LED_G.off(); LED_Y.off()
-                    LED_R.blink(on_time=0.15, off_time=0.15)
-                    # Show timeout UI with guards
-                    try:
-                        lcd_safe_clear()
-                        for attempt in range(2):
-                            try:
-                                lcd.lcd_display_string("   TIME IS UP", 1)
-                                lcd.lcd_display_string("Press for next", 2)
-                                break
-                            except OSError:
-                                lcd.soft_reset()
-                    except OSError:
-                        lcd.soft_reset()
+                    game.state = State.TIMEOUT
+                    play_pattern(TIMEOUT_TONES)
+                    leds.off()
+                    leds.red.blink(on_time=0.15, off_time=0.15)
+                    _last_zone = None
+                    lcd_idle("   TIME IS UP", "Press for next")
+                else:
+                    # Sleep until the displayed second changes. The target is
+                    # derived from the absolute deadline, so ticks don't drift.
+                    wait_ns = (game.deadline_ns - monotonic_ns()) % 1_000_000_000 or 1_000_000_000
+                    if buzz_ns is not None:
+                        wait_ns = min(wait_ns, buzz_ns)
+                    wake.wait(wait_ns / 1e9)
+                    wake.clear()
             else:
-                sleep(0.05)  # idle/time-out chill
+                # idle/time-out: block until a press (or the next tone step)
+                wake.wait(None if buzz_ns is None else buzz_ns / 1e9)
+                wake.clear()
     except KeyboardInterrupt:
         print("\nExiting program.")
     finally:
         print("Cleaning up GPIO and LCD.")
+        _lcd_put(None)   # let the worker finish its frame, then take the LCD back
+        if lcd_thread.is_alive():
+            lcd_thread.join(timeout=1.0)
         try:
             lcd_safe_clear()
         except Exception:
             pass
         buzzer.close()
-        LED_G.close(); LED_Y.close(); LED_R.close()
+        leds.close()
         btn.close()
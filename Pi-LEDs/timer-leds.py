@@ -1,10 +1,26 @@
 # pi_timer_leds.py
 # Two-player turn timer with a single button, LED status, and buzzer.
 # Hardware: Raspberry Pi GPIO, one momentary button (to GND), 3 LEDs (G/Y/R), piezo buzzer on PWM pin.
+# Requires: gpiozero, optionally lgpio
 # Usage: python3 pi_timer_leds.py
 
-from gpiozero import Button, PWMOutputDevice, LED
-from time import monotonic, sleep
+import os
+from gpiozero import Device, Button, PWMOutputDevice, LEDBoard
+from gpiozero.exc import BadPinFactory
+from time import sleep
+from enum import IntEnum
+from threading import Timer, Lock
+import signal
+
+# Prefer lgpio (kernel GPIO character device: the button is interrupt-driven
+# instead of spin-polled). Without it gpiozero keeps its own default order;
+# GPIOZERO_PIN_FACTORY=... still overrides both.
+if "GPIOZERO_PIN_FACTORY" not in os.environ:
+    try:
+        from gpiozero.pins.lgpio import LGPIOFactory
+        Device.pin_factory = LGPIOFactory()
+    except (ImportError, BadPinFactory):
+        pass
 
 # --- CONFIG ---
 TURN_SECONDS = 10          # default per-turn time
@@ -20,46 +36,96 @@ LED_R_PIN = 25
 # Hardware
 btn = Button(BUTTON_PIN, pull_up=True, bounce_time=0.05)
 buzzer = PWMOutputDevice(BUZZER_PIN, frequency=1000)  # 1 kHz tone when value>0
-LED_G = LED(LED_G_PIN)
-LED_Y = LED(LED_Y_PIN)
-LED_R = LED(LED_R_PIN)
+leds = LEDBoard(green=LED_G_PIN, yellow=LED_Y_PIN, red=LED_R_PIN)
 
 # State
-state = "IDLE"             # IDLE, P1_RUNNING, P2_RUNNING, TIMEOUT
-active_player = 1
-deadline = None
+class State(IntEnum):
+    IDLE = 0
+    P1 = 1        # player 1's turn running
+    P2 = 2        # player 2's turn running
+    TIMEOUT = 3
+
+RUNNING = frozenset((State.P1, State.P2))
+
+class Game:
+    __slots__ = ("state", "active_player", "turn")
+
+    def __init__(self):
+        self.state = State.IDLE
+        self.active_player = 1
+        self.turn = 0      # bumped every turn so stale timer callbacks can bail out
+
+game = Game()
+turn_timers = []           # yellow/red/timeout timers for the current turn
+lock = Lock()              # button callback vs. timer threads
 
 def lights_for(remaining):
+    # One LEDBoard write per update: no half-switched frame between LEDs
     if remaining > WARN_YELLOW:
-        LED_G.on(); LED_Y.off(); LED_R.off()
+        leds.value = (1, 0, 0)
     elif remaining > WARN_RED:
-        LED_G.off(); LED_Y.on(); LED_R.off()
+        leds.value = (0, 1, 0)
     else:
-        LED_G.off(); LED_Y.off(); LED_R.on()
+        leds.value = (0, 0, 1)
+
+_last_freq = buzzer.frequency  # PWM period currently programmed
 
 def beep(freq=1000, duration=0.2, vol=0.5):
-    buzzer.frequency = freq
+    global _last_freq
+    if freq != _last_freq:   # reprogramming the PWM period is a syscall
+        buzzer.frequency = freq
+        _last_freq = freq
     buzzer.value = vol
     sleep(duration)
     buzzer.value = 0
 
+def on_warning(for_turn, remaining):
+    with lock:
+        if for_turn == game.turn:
+            lights_for(remaining)
+
+def on_timeout(for_turn):
+    with lock:
+        if for_turn != game.turn:
+            return
+        game.state = State.TIMEOUT
+    # timeout alarm (descending tones)
+    for f in (1200, 1000, 800, 600, 400):
+        beep(f, 0.1, 0.7)
+        sleep(0.03)
+    with lock:
+        if for_turn == game.turn:
+            leds.off(); leds.red.blink(on_time=0.15, off_time=0.15)
+
 def start_turn(player):
-    global state, active_player, deadline
-    active_player = player
-    deadline = monotonic() + TURN_SECONDS
-    state = "P1_RUNNING" if player == 1 else "P2_RUNNING"
+    """Start a turn: LEDs go green now, timers handle yellow, red and timeout."""
+    with lock:
+        for t in turn_timers:
+            t.cancel()
+        game.turn += 1
+        game.active_player = player
+        game.state = State.P1 if player == 1 else State.P2
+        lights_for(TURN_SECONDS)
+        turn = game.turn
+        turn_timers[:] = [
+            Timer(TURN_SECONDS - WARN_YELLOW, on_warning, (turn, WARN_YELLOW)),
+            Timer(TURN_SECONDS - WARN_RED, on_warning, (turn, WARN_RED)),
+            Timer(TURN_SECONDS, on_timeout, (turn,)),
+        ]
+        for t in turn_timers:
+            t.daemon = True
+            t.start()
     # start sound (two short beeps for P1, three for P2)
     for _ in range(2 if player == 1 else 3):
         beep(1200 if player == 1 else 900, 0.08)
         sleep(0.07)
 
 def next_player():
-    start_turn(2 if active_player == 1 else 1)
+    start_turn(2 if game.active_player == 1 else 1)
 
 def on_press():
-    global state
-    if state in ("IDLE", "TIMEOUT"):
-        start_turn(1 if state == "IDLE" else (2 if active_player == 1 else 1))
+    if game.state not in RUNNING:
+        start_turn(1 if game.state == State.IDLE else (2 if game.active_player == 1 else 1))
     else:
         next_player()
 
@@ -67,21 +133,11 @@ btn.when_pressed = on_press
 
 try:
     print("Game Timer Ready. Press button to start.")
-    while True:
-        if state in ("P1_RUNNING", "P2_RUNNING"):
-            remaining = max(0, int(round(deadline - monotonic())))
-            lights_for(remaining)
-            if remaining <= 0:
-                state = "TIMEOUT"
-                # timeout alarm (descending tones)
-                for f in (1200, 1000, 800, 600, 400):
-                    beep(f, 0.1, 0.7)
-                    sleep(0.03)
-                LED_G.off(); LED_Y.off(); LED_R.blink(on_time=0.15, off_time=0.15)
-        else:
-            sleep(0.05)
+    signal.pause()   # everything happens in button/timer callbacks
 except KeyboardInterrupt:
     pass
 finally:
+    for t in turn_timers:
+        t.cancel()
     buzzer.value = 0
-    LED_G.off(); LED_Y.off(); LED_R.off()
+    leds.off()
@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 # pi_timer_lcd_speaker_customwav.py
 # Two-player turn timer with 16x2 I2C LCD + LEDs, sound via 3.5mm jack or bluetooth(ALSA).
-# Uses your own WAVs when present (audio/*.wav), otherwise falls back to generated tones.
-# Requires: gpiozero, smbus (or smbus2), alsa-utils (aplay)
+# Uses your own WAVs when present (audio/*.wav, 16-bit), otherwise falls back to generated tones.
+# Requires: gpiozero, optionally lgpio, smbus2, numpy, sounddevice (PortAudio)
 
-from gpiozero import Button, LED
+import os
+from gpiozero import Device, Button, LED
+from gpiozero.exc import BadPinFactory
 from time import monotonic, sleep
-import smbus
-import math, struct, wave, io, tempfile, subprocess, os, sys
+from enum import IntEnum
+from smbus2 import SMBus, i2c_msg
+import wave, sys, threading, re
+import numpy as np
+import sounddevice as sd
+
+# Prefer lgpio (kernel GPIO character device: the button is interrupt-driven
+# instead of spin-polled). Without it gpiozero keeps its own default order;
+# GPIOZERO_PIN_FACTORY=... still overrides both.
+if "GPIOZERO_PIN_FACTORY" not in os.environ:
+    try:
+        from gpiozero.pins.lgpio import LGPIOFactory
+        Device.pin_factory = LGPIOFactory()
+    except (ImportError, BadPinFactory):
+        pass
 
 # --- USER CONFIG ---
 TURN_SECONDS = 10
@@ -28,6 +43,10 @@ LED_R_PIN = 25
 # I2C LCD
 I2C_ADDRESS = 0x27   # 0x3F for some backpacks
 I2C_BUS = 1          # 0 on very old Pi, else 1
+# Bus clock the LCD code is tuned for (Pi default is 100 kHz). Set it in
+# /boot/firmware/config.txt and reboot:
+#   dtparam=i2c_arm=on,i2c_arm_baudrate=400000
+I2C_BAUDRATE = 400000
 
 # Audio folder (place audio files here)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -38,12 +57,10 @@ AUDIO_DIR = os.path.join(SCRIPT_DIR, "audio")
 # =================================================================
 
 class i2c_device:
-    def __init__(self, addr, port=1):
+    def __init__(self, addr, port=1, bus=None):
         self.addr = addr
-        self.bus = smbus.SMBus(port)
-    def write_cmd(self, cmd):
-        self.bus.write_byte(self.addr, cmd)
-        sleep(0.0001)
+        # Pass an open SMBus to share one /dev/i2c-N handle between peripherals
+        self.bus = bus if bus is not None else SMBus(port)
 
 class lcd:
     LCD_CLEARDISPLAY   = 0x01
@@ -68,189 +85,340 @@ class lcd:
     Rw = 0b00000010
     Rs = 0b00000001
 
-    def __init__(self, addr, port):
-        self.lcd_device = i2c_device(addr, port)
-        # Init
-        self.lcd_write(0x03); self.lcd_write(0x03); self.lcd_write(0x03); self.lcd_write(0x02)
+    def __init__(self, addr, port, bus=None):
+        self.lcd_device = i2c_device(addr, port, bus)
+        self._shadow = [b"", b""]   # bytes lines 1/2 currently show (b"" = unknown)
+        # Init (reset-to-4-bit writes need >4.1 ms each; nothing else waits)
+        for cmd in (0x03, 0x03, 0x03, 0x02):
+            self.lcd_write(cmd); sleep(0.005)
         self.lcd_write(self.LCD_FUNCTIONSET | self.LCD_2LINE | self.LCD_5x8DOTS | self.LCD_4BITMODE)
         self.lcd_write(self.LCD_DISPLAYCONTROL | self.LCD_DISPLAYON | self.LCD_CURSOROFF | self.LCD_BLINKOFF)
         self.lcd_write(self.LCD_ENTRYMODESET | self.LCD_ENTRYLEFT)  # increment, no display shift
         self.lcd_clear(); sleep(0.2)
 
-    def lcd_strobe(self, data):
-        self.lcd_device.write_cmd(data | self.En | self.LCD_BACKLIGHT)
-        sleep(0.0005)
-        self.lcd_device.write_cmd((data & ~self.En) | self.LCD_BACKLIGHT)
-        sleep(0.0001)
-
-    def lcd_write_four_bits(self, data):
-        self.lcd_device.write_cmd(data | self.LCD_BACKLIGHT)
-        self.lcd_strobe(data)
+    def _queue_byte(self, buf, value, mode=0):
+        # Per nibble: latch data, raise En, drop En (falling edge latches).
+        # No sleeps needed: E falling edges are 3 I2C bytes apart (~67 us
+        # @400 kHz), which covers the 37 us HD44780 command time. Assumes a
+        # bus clock of <= 400 kHz; at 1 MHz that gap is ~27 us, too short.
+        bl, en = self.LCD_BACKLIGHT, self.En
+        for nibble in (value & 0xF0, (value << 4) & 0xF0):
+            d = mode | nibble | bl
+            buf += bytes((d, d | en, d))
+
+    def _flush(self, buf):
+        """Send everything queued in buf as a single I2C transaction."""
+        if buf:
+            self.lcd_device.bus.i2c_rdwr(i2c_msg.write(self.lcd_device.addr, bytes(buf)))
 
     def lcd_write(self, cmd, mode=0):
-        self.lcd_write_four_bits(mode | (cmd & 0xF0))
-        self.lcd_write_four_bits(mode | ((cmd << 4) & 0xF0))
+        buf = bytearray()
+        self._queue_byte(buf, cmd, mode)
+        self._flush(buf)
 
     def lcd_clear(self):
+        # Clear/home are the only slow HD44780 commands (~1.52 ms each)
         self.lcd_write(self.LCD_CLEARDISPLAY)
+        sleep(0.002)
         self.lcd_write(self.LCD_RETURNHOME)
         sleep(0.002)
-
-    def lcd_display_string(self, string, line):
+        self._shadow = [b" " * 16, b" " * 16]
+
+    def _queue_line(self, buf, bs, line):
+        """Queue what it takes to turn line 1/2 from the shadow into bs."""
+        old = self._shadow[line - 1]
+        if bs == old:
+            return
+        if old:
+            start = next(i for i in range(16) if bs[i] != old[i])
+            end = next(i for i in range(15, -1, -1) if bs[i] != old[i]) + 1
+        else:
+            start, end = 0, 16
         # Proper DDRAM addresses: line1=0x00, line2=0x40
-        if line == 1:
-            self.lcd_write(self.LCD_SETDDRAMADDR | 0x00)
-        elif line == 2:
-            self.lcd_write(self.LCD_SETDDRAMADDR | 0x40)
-        string = string.ljust(16)[:16]
-        for ch in string:
-            self.lcd_write(ord(ch), self.Rs)
+        base = 0x00 if line == 1 else 0x40
+        self._queue_byte(buf, self.LCD_SETDDRAMADDR | (base + start))
+        for b in bs[start:end]:
+            self._queue_byte(buf, b, self.Rs)
+
+    def lcd_draw_frame(self, l1, l2):
+        """Bring both lines (16 bytes each) up to date in one I2C transaction."""
+        buf = bytearray()
+        self._queue_line(buf, l1, 1)
+        self._queue_line(buf, l2, 2)
+        self._flush(buf)
+        self._shadow = [l1, l2]
+
+    @staticmethod
+    def line_bytes(string):
+        return string.ljust(16)[:16].encode('ascii', 'replace')
+
+def i2c_bus_speed(port=1):
+    """Return the I2C clock in Hz (device tree, else config.txt), or None."""
+    path = f"/sys/class/i2c-adapter/i2c-{port}/of_node/clock-frequency"
+    try:
+        with open(path, "rb") as f:
+            return int.from_bytes(f.read(4), "big")
+    except OSError:
+        pass
+    for path in ("/boot/firmware/config.txt", "/boot/config.txt"):
+        try:
+            with open(path) as f:
+                m = re.search(r"^dtparam=.*i2c(?:_arm|1)?_baudrate=(\d+)", f.read(), re.M)
+        except OSError:
+            continue
+        return int(m.group(1)) if m else 100000   # Pi default
+    return None
 
 # =================================================================
 # == END: I2C LCD DRIVER CODE
 # =================================================================
 
-# --- AUDIO HELPERS (ALSA via aplay) ---
+# --- AUDIO HELPERS (one persistent PortAudio stream) ---
 SR = 44100
 
-def play_wav_if_exists(filename, blocking=True):
-    """Play audio/<filename> if present. Returns True if played."""
-    path = os.path.join(AUDIO_DIR, filename)
-    if not os.path.exists(path):
-        return False
+# Opened once: no aplay fork/exec or ALSA device open/close per sound.
+# Sound is optional: with no output device (e.g. BT speaker not paired yet)
+# the timer runs silently.
+try:
+    stream = sd.OutputStream(samplerate=SR, channels=2, dtype='int16',
+                             blocksize=2048, latency='high')
+    stream.start()
+except sd.PortAudioError as e:
+    sys.stderr.write(f"WARN: no audio output ({e}); running without sound\n")
+    stream = None
+audio_lock = threading.Lock()   # one writer at a time (intro thread vs. main)
+
+def play_frames(frames):
+    """Queue int16 stereo frames on the stream; blocks until they are buffered."""
+    if stream is None:
+        return
+    with audio_lock:
+        try:
+            stream.write(frames)
+        except sd.PortAudioError:
+            pass   # device went away mid-game; keep the timer running
+
+def silence(ms):
+    return np.zeros((int(SR * ms / 1000.0), 2), dtype=np.int16)
+
+def load_wav(path):
+    """Read a 16-bit WAV as int16 stereo frames at SR (mono/other rates converted)."""
+    with wave.open(path, 'rb') as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit WAVs are supported")
+        ch, rate = wf.getnchannels(), wf.getframerate()
+        data = np.frombuffer(wf.readframes(wf.getnframes()), dtype='<i2').reshape(-1, ch)
+    data = np.repeat(data, 2, axis=1) if ch == 1 else data[:, :2]
+    if rate != SR:   # linear resample; fine for short cues
+        src = np.arange(len(data))
+        dst = np.linspace(0, len(data) - 1, int(len(data) * SR / rate))
+        data = np.stack([np.interp(dst, src, data[:, c]) for c in (0, 1)], axis=1)
+    return np.ascontiguousarray(data, dtype=np.int16)
+
+# Custom sounds, decoded into RAM once at startup (None = missing/unreadable)
+AUDIO = {}
+for _name in (INTRO_SOUND, EXIT_SOUND, BEEP_SOUND, TIMEOUT_SOUND):
+    _path = os.path.join(AUDIO_DIR, _name)
     try:
-        if blocking:
-            subprocess.run(["aplay", "-q", path], check=False)
-        else:
-            subprocess.Popen(["aplay", "-q", path])  # non-blocking
-        return True
-    except FileNotFoundError:
-        # aplay not found
+        AUDIO[_name] = load_wav(_path) if os.path.exists(_path) else None
+    except (wave.Error, ValueError, EOFError):
+        AUDIO[_name] = None
+
+def play_wav_if_exists(filename, blocking=True):
+    """Play preloaded audio/<filename> if present. Returns True if played."""
+    frames = AUDIO.get(filename)
+    if frames is None:
         return False
+    if blocking:
+        play_frames(frames)
+    else:
+        threading.Thread(target=play_frames, args=(frames,), daemon=True).start()
+    return True
 
-def _tone_wav_bytes(freq_hz=1000, ms=120, volume=0.5):
+def _tone_frames(freq_hz=1000, ms=120, volume=0.5):
     n = int(SR * ms / 1000.0)
-    amp = int(32767 * max(0.0, min(1.0, volume)))
-    frames = bytearray()
-    for i in range(n):
-        s = int(amp * math.sin(2 * math.pi * freq_hz * i / SR))
-        frames += struct.pack('<h', s) * 2  # stereo
-    bio = io.BytesIO()
-    with wave.open(bio, 'wb') as wf:
-        wf.setnchannels(2); wf.setsampwidth(2); wf.setframerate(SR)
-        wf.writeframes(frames)
-    return bio.getvalue()
-
-def play_tone(freq=1000, ms=120, vol=0.5):
-    """Fallback tone via a temporary WAV + aplay."""
-    data = _tone_wav_bytes(freq, ms, vol)
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as f:
-        f.write(data); path = f.name
-    try:
-        subprocess.run(['aplay', '-q', path], check=False)
-    finally:
-        try: os.unlink(path)
-        except OSError: pass
+    amp = np.int16(32767 * max(0.0, min(1.0, volume)))
+    t = np.arange(n, dtype=np.float32)
+    mono = (amp * np.sin(2 * np.pi * freq_hz * t / SR)).astype(np.int16, copy=False)
+    return np.repeat(mono[:, None], 2, axis=1)  # stereo L+R
+
+def _square_frames(freq_hz=1000, ms=120, volume=0.5):
+    # Integer half-period count decides the sign: no sin() per sample
+    n = int(SR * ms / 1000.0)
+    amp = np.int16(32767 * max(0.0, min(1.0, volume)))
+    mono = np.where((2 * freq_hz * np.arange(n) // SR) % 2 == 0, amp, -amp).astype(np.int16)
+    return np.repeat(mono[:, None], 2, axis=1)  # stereo L+R
+
+ALARM_TONES = [(f, 120, 0.7) for f in (1200, 1000, 800, 600, 400)]
+
+def _make_beeps(count, tone, gap_ms=70):
+    """count tones with the silent gaps baked in, as one clip."""
+    beep, gap = _tone_frames(*tone), silence(gap_ms)
+    return np.concatenate([beep if i % 2 == 0 else gap for i in range(2 * count - 1)])
+
+# Turn-start fallback: P1=2 beeps @1200Hz, P2=3 beeps @900Hz
+BEEPS = {1: _make_beeps(2, (1200, 80, 0.6)), 2: _make_beeps(3, (900, 80, 0.6))}
+
+# Timeout fallback: the descending sweep as one square-wave clip, so it holds
+# the stream once (a siren needs no sine purity; the start beeps keep sine)
+ALARM = np.concatenate([part for tone in ALARM_TONES
+                        for part in (_square_frames(*tone), silence(30))])
 
 # --- APP STATE & HARDWARE ---
 
-btn = Button(BUTTON_PIN, pull_up=True, bounce_time=0.05)
+btn = Button(BUTTON_PIN, pull_up=True, bounce_time=0.1, hold_time=1.5)
 LED_G = LED(LED_G_PIN)
 LED_Y = LED(LED_Y_PIN)
 LED_R = LED(LED_R_PIN)
 
-lcd = lcd(addr=I2C_ADDRESS, port=I2C_BUS)
+i2c_bus = SMBus(I2C_BUS)   # shared by the LCD and any other I2C peripherals
+lcd = lcd(addr=I2C_ADDRESS, port=I2C_BUS, bus=i2c_bus)
+
+class State(IntEnum):
+    IDLE = 0
+    P1 = 1        # player 1's turn running
+    P2 = 2        # player 2's turn running
+    TIMEOUT = 3
+
+RUNNING = frozenset((State.P1, State.P2))
+
+class Game:
+    __slots__ = ("state", "active_player", "deadline")
+
+    def __init__(self):
+        self.state = State.IDLE
+        self.active_player = 1
+        self.deadline = 0.0   # monotonic() at which the current turn ends
 
-state = "IDLE"           # IDLE, P1_RUNNING, P2_RUNNING, TIMEOUT
-active_player = 1
-deadline = None
+game = Game()
+_last_press = 0.0        # monotonic() of the last accepted press
+_last_shown = None       # (player, remaining) or idle State on the LCD; None forces a redraw
+wake = threading.Event()   # set when a turn starts so the main loop reacts at once
 
 # --- UI HELPERS ---
 
+_last_lights = None      # 'G', 'Y' or 'R' currently lit; None forces a write
+
 def lights_for(remaining):
-    if remaining > WARN_YELLOW:
-        LED_G.on(); LED_Y.off(); LED_R.off()
-    elif remaining > WARN_RED:
-        LED_G.off(); LED_Y.on(); LED_R.off()
-    else:
-        LED_G.off(); LED_Y.off(); LED_R.on()
+    """Set the LEDs for remaining time; only touches GPIO when the colour changes."""
+    global _last_lights
+    want = 'G' if remaining > WARN_YELLOW else 'Y' if remaining > WARN_RED else 'R'
+    if want == _last_lights:
+        return
+    _last_lights = want
+    LED_G.value = (want == 'G'); LED_Y.value = (want == 'Y'); LED_R.value = (want == 'R')
 
 def start_beeps(for_player):
     # Use custom file if provided; same file for both players
     if play_wav_if_exists(BEEP_SOUND):
         return
-    # Fallback: P1=2 beeps @1200Hz, P2=3 beeps @900Hz
-    count = 2 if for_player == 1 else 3
-    freq = 1200 if for_player == 1 else 900
-    for _ in range(count):
-        play_tone(freq, 80, 0.6); sleep(0.07)
+    play_frames(BEEPS[for_player])
 
 def timeout_alarm():
     if play_wav_if_exists(TIMEOUT_SOUND):
         return
-    for f in (1200, 1000, 800, 600, 400):
-        play_tone(f, 120, 0.7); sleep(0.03)
+    play_frames(ALARM)
+
+# Every frame lcd_show can draw, encoded once (indexed by player / seconds left)
+PLAYER_LINE = [("Player " + str(p)).ljust(16).encode() for p in (0, 1, 2)]
+TIME_LINE = [("Time: " + str(r).rjust(3) + "s").ljust(16).encode()
+             for r in range(TURN_SECONDS + 1)]
 
 def lcd_show(player, remaining):
-    lcd.lcd_display_string(f"Player {player}", 1)
-    lcd.lcd_display_string(f"Time: {remaining:>3}s", 2)
+    lcd.lcd_draw_frame(PLAYER_LINE[player], TIME_LINE[remaining])
 
 def lcd_idle(msg_top="Press to start", msg_bot="   Game Timer"):
     lcd.lcd_clear()
-    lcd.lcd_display_string(msg_top, 1)
-    lcd.lcd_display_string(msg_bot, 2)
+    lcd.lcd_draw_frame(lcd.line_bytes(msg_top), lcd.line_bytes(msg_bot))
 
 def start_turn(player):
-    """Start new turn (clears TIMEOUT UI)."""
-    global state, active_player, deadline
-    active_player = player
-    deadline = monotonic() + TURN_SECONDS
-    state = "P1_RUNNING" if player == 1 else "P2_RUNNING"
-    LED_R.off()
-    lcd.lcd_clear()
+    """Start new turn. Runs on the button thread, so it leaves the LCD/LEDs
+    to the main loop, which redraws as soon as (player, remaining) changes."""
+    game.active_player = player
+    game.deadline = monotonic() + TURN_SECONDS
+    game.state = State.P1 if player == 1 else State.P2
+    wake.set()
     start_beeps(player)
 
 def next_player():
-    start_turn(2 if active_player == 1 else 1)
+    start_turn(2 if game.active_player == 1 else 1)
 
 def on_press():
-    global state
-    if state in ("IDLE", "TIMEOUT"):
-        next_p = 1 if state == "IDLE" else (2 if active_player == 1 else 1)
+    global _last_press
+    # Software guard for contact bounce that slips past bounce_time
+    now = monotonic()
+    if now - _last_press < 0.2:
+        return
+    _last_press = now
+    if game.state not in RUNNING:
+        next_p = 1 if game.state == State.IDLE else (2 if game.active_player == 1 else 1)
         start_turn(next_p)
     else:
         next_player()
 
+def reset_game():
+    """Long press (hold_time): abandon the game; the main loop draws the idle screen."""
+    game.state = State.IDLE
+    wake.set()
+
 # --- MAIN LOOP ---
 if __name__ == "__main__":
     btn.when_pressed = on_press
+    btn.when_held = reset_game
     try:
-        lcd_idle()
         # Optional intro sound (non-blocking so UI appears immediately)
         play_wav_if_exists(INTRO_SOUND, blocking=False)
 
+        hz = i2c_bus_speed(I2C_BUS)
+        if hz is not None and hz < I2C_BAUDRATE:
+            sys.stderr.write(f"WARN: I2C runs at {hz // 1000} kHz; set dtparam=i2c_arm_baudrate="
+                             f"{I2C_BAUDRATE} in /boot/firmware/config.txt for faster LCD updates\n")
         print("LCD Game Timer (speaker) ready. Press button to start.")
         while True:
-            if state in ("P1_RUNNING", "P2_RUNNING"):
-                remaining = max(0, int(round(deadline - monotonic())))
-                lights_for(remaining)
-                lcd_show(active_player, remaining)
+            if game.state in RUNNING:
+                player = game.active_player
+                remaining = max(0, int(round(game.deadline - monotonic())))
+                if (player, remaining) != _last_shown:
+                    lights_for(remaining)
+                    lcd_show(player, remaining)
+                    _last_shown = (player, remaining)
 
                 if remaining <= 0:
-                    state = "TIMEOUT"
-                    timeout_alarm()
-                    LED_G.off(); LED_Y.off
-                    LED_R.blink(on_time=0.15, off_time=0.15)
-                    lcd_idle("   TIME IS UP", "Press for next")
+                    game.state = State.TIMEOUT
+                    # Alarm plays in the background so TIME IS UP shows at once
+                    threading.Thread(target=timeout_alarm, daemon=True).start()
+                else:
+                    wake.wait(0.1)   # only second boundaries matter
+                    wake.clear()
             else:
-                sleep(0.05)  # idle/TIMEOUT wait
+                state = game.state
+                if state != _last_shown:   # just went IDLE/TIMEOUT: draw it once
+                    _last_shown = state
+                    LED_G.off(); LED_Y.off()
+                    _last_lights = None
+                    if state == State.TIMEOUT:
+                        LED_R.blink(on_time=0.15, off_time=0.15)
+                        lcd_idle("   TIME IS UP", "Press for next")
+                    else:
+                        LED_R.off()
+                        lcd_idle()
+                wake.wait()   # idle/TIMEOUT: sleep until a press starts a turn
+                wake.clear()
     except KeyboardInterrupt:
         print("\nExiting program.")
     finally:
         # Optional outro sound (blocking to finish cleanly)
         play_wav_if_exists(EXIT_SOUND, blocking=True)
 
+        if stream is not None:
+            try:
+                stream.stop()    # plays out what is buffered, then closes the device
+                stream.close()
+            except sd.PortAudioError:
+                pass
+
         print("Cleaning up GPIO and LCD.")
         lcd.lcd_clear()
+        i2c_bus.close()
         LED_G.close(); LED_Y.close(); LED_R.close()
         btn.close()